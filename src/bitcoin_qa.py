@@ -1,26 +1,97 @@
 import sqlite3
 from openai import OpenAI
 import os
-from typing import Dict, List, Optional
+import csv
+import io
+from typing import Dict, List, Optional, Tuple
 import json
+import logging
+import msgspec
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 import chainlit as cl
-from tabulate import tabulate
+
+from db_utils import FETCH_SIZE, prewarm
+from formatting import fast_grid
 
 # Load environment variables
 load_dotenv('bitcoin_config.env')
 
+logger = logging.getLogger(__name__)
+
+# Upper bound on rows returned for a generated query
+MAX_RESULT_ROWS = 1000
+
+# Results longer than this are sent as CSV instead of a grid table
+CSV_RESULT_THRESHOLD = 100
+
+# Number of distinct questions whose generated SQL is remembered once it has run successfully
+SQL_CACHE_SIZE = 512
+
+BASE_PROMPT = """You are a SQL developer that is expert in Bitcoin and you answer natural language questions about the bitcoind database in a sqlite database. 
+The database contains blocks, transactions, inputs, and outputs tables with their relationships.
+You should generate SQL queries that are efficient and accurate.
+Always consider using appropriate indexes for better performance.
+You always only respond with SQL statements that are correct and optimized."""
+
+def _configure(conn: sqlite3.Connection) -> None:
+    """Apply read-friendly PRAGMAs to a new SQLite connection."""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-262144")  # 256 MB page cache
+    conn.execute("PRAGMA mmap_size=4294967296")  # 4 GB memory map
+
+def _msgpack_text(value: Optional[bytes]) -> Optional[str]:
+    """SQL function msgpack_text(): decode a msgpack script BLOB to JSON text."""
+    if value is None:
+        return None
+    return msgspec.json.encode(msgspec.msgpack.decode(value)).decode()
+
+# Result columns holding msgpack-encoded scripts, decoded to JSON for display
+SCRIPT_COLUMNS = frozenset({"script_sig", "script_pubkey"})
+
+def _display_value(column: str, value):
+    """Show script BLOBs as decoded JSON and any other BLOB as its size."""
+    if not isinstance(value, bytes):
+        return value
+    if column in SCRIPT_COLUMNS:
+        try:
+            return _msgpack_text(value)
+        except (msgspec.MsgspecError, TypeError):
+            pass
+    return f"<{len(value)} bytes>"
+
 class BitcoinQA:
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # One connection per instance keeps SQLite's page cache warm across questions;
+        # Chainlit handlers may overlap, so access is serialized with a lock
+        self._conn = sqlite3.connect(self.db_path, detect_types=0, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        _configure(self._conn)
+        # Generated SQL only ever needs to read
+        self._conn.execute("PRAGMA query_only = ON")
+        self._conn.create_function("msgpack_text", 1, _msgpack_text, deterministic=True)
+        self._lock = threading.Lock()
+        # Normalized question -> SQL that ran without error, least recently used first
+        self._sql_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._sql_cache_lock = threading.Lock()
+        self._prewarm()
         self.schema = self._get_schema()
-        self.system_prompt = """You are a SQL developer that is expert in Bitcoin and you answer natural language questions about the bitcoind database in a sqlite database. 
-        The database contains blocks, transactions, inputs, and outputs tables with their relationships.
-        You should generate SQL queries that are efficient and accurate.
-        Always consider using appropriate indexes for better performance.
-        You always only respond with SQL statements that are correct and optimized."""
+        # The schema is part of the fixed system prompt so every request shares
+        # the same prefix, which OpenAI's prompt caching can reuse
+        self.system_prompt = BASE_PROMPT + "\n\n### Database Schema\n" + self.schema
         self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
         
+    def _prewarm(self) -> None:
+        """Pull the database file into the OS page cache before the first question."""
+        try:
+            prewarm(self.db_path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error pre-warming database: {e}")
+
     def _get_schema(self) -> str:
         """Read schema information from lastest_block.sql file."""
         try:
@@ -34,85 +105,130 @@ class BitcoinQA:
             print(f"Error reading schema file: {e}")
             return ""
 
-    def _execute_query(self, query: str) -> List[Dict]:
-        """Execute SQL query and return results as list of dictionaries."""
+    def _execute_query(self, query: str) -> Tuple[Optional[List[Dict]], bool]:
+        """Execute SQL query and return results as list of dictionaries.
+        
+        The results are None if the query failed. The second value is True when
+        the query had more than MAX_RESULT_ROWS rows.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                
-                # Log the query being executed
-                print(f"Executing query: {query}")
-                
-                # Execute the query
-                cursor.execute(query)
-                
-                # Get the results
-                results = [dict(row) for row in cursor.fetchall()]
-                
-                # Log the number of results
-                print(f"Query returned {len(results)} rows")
-                
-                # For debugging, print the first result if any
-                if results:
-                    print(f"First result: {results[0]}")
-                else:
-                    print("No results returned from query")
-                
-                return results
-                
+            # Log the query being executed
+            logger.debug("Executing query: %s", query)
+            
+            # Execute the query and get the results, capped at MAX_RESULT_ROWS
+            results = []
+            truncated = False
+            with self._lock:
+                cursor = self._conn.execute(query)
+                while len(results) < MAX_RESULT_ROWS:
+                    chunk = cursor.fetchmany(min(FETCH_SIZE, MAX_RESULT_ROWS - len(results)))
+                    if not chunk:
+                        break
+                    results.extend(dict(row) for row in chunk)
+                # One extra row tells a capped result apart from one that fit exactly
+                if len(results) == MAX_RESULT_ROWS:
+                    truncated = cursor.fetchone() is not None
+            
+            # Log the number of results
+            logger.debug("Query returned %d rows", len(results))
+            if truncated:
+                logger.debug("Results capped at %d rows", MAX_RESULT_ROWS)
+            
+            # For debugging, log the first result if any
+            if results:
+                logger.debug("First result: %s", results[0])
+            else:
+                logger.debug("No results returned from query")
+            
+            return results, truncated
+            
         except sqlite3.Error as e:
             print(f"SQLite error executing query: {e}")
             print(f"Query that caused error: {query}")
-            return []
+            return None, False
         except Exception as e:
             print(f"Unexpected error executing query: {e}")
             print(f"Query that caused error: {query}")
-            return []
+            return None, False
 
-    def ask(self, question: str) -> Dict:
-        """Process natural language question and return SQL query with results."""
-        try:
-            # Prepare the prompt with schema and question
-            user_prompt = f"""Database Schema:
-{self.schema}
+    def _cached_sql(self, question: str) -> Optional[str]:
+        """Return the remembered SQL for a question, marking it most recently used."""
+        with self._sql_cache_lock:
+            sql_query = self._sql_cache.get(question)
+            if sql_query is not None:
+                self._sql_cache.move_to_end(question)
+            return sql_query
+
+    def _remember_sql(self, question: str, sql_query: str) -> None:
+        """Remember SQL that ran successfully, evicting the least recently used entry when full."""
+        with self._sql_cache_lock:
+            self._sql_cache[question] = sql_query
+            self._sql_cache.move_to_end(question)
+            if len(self._sql_cache) > SQL_CACHE_SIZE:
+                self._sql_cache.popitem(last=False)
 
-Question: {question}
+    def _forget_sql(self, question: str) -> None:
+        """Drop the remembered SQL for a question, e.g. after it stopped working."""
+        with self._sql_cache_lock:
+            self._sql_cache.pop(question, None)
+
+    def _generate_sql(self, question: str) -> str:
+        """Ask the LLM for the SQL query answering a question."""
+        user_prompt = f"""Question: {question}
 
 Please provide ONLY the SQL query that answers this question. Do not include any explanations or additional text. The response should be a single SQL statement."""
 
-            # Make API call to OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.1
-            )
-
-            # Extract SQL query from response and clean it
-            sql_query = response.choices[0].message.content.strip()
-            
-            # Remove any markdown code block indicators
-            sql_query = sql_query.replace('```sql', '').replace('```', '')
-            
-            # Remove any leading/trailing whitespace and newlines
-            sql_query = sql_query.strip()
+        # Make API call to OpenAI
+        response = self.client.chat.completions.create(
+            model="gpt-4",
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.1
+        )
+
+        # Extract SQL query from response and clean it
+        sql_query = response.choices[0].message.content.strip()
+        
+        # Remove any markdown code block indicators
+        sql_query = sql_query.replace('```sql', '').replace('```', '')
+        
+        # Remove any leading/trailing whitespace and newlines
+        return sql_query.strip()
+
+    def ask(self, question: str) -> Dict:
+        """Process natural language question and return SQL query with results."""
+        try:
+            # Collapse whitespace so trivially different phrasings share a cache entry;
+            # case is kept because addresses and hashes are case-sensitive
+            key = " ".join(question.split())
+            sql_query = self._cached_sql(key)
+            if sql_query is None:
+                sql_query = self._generate_sql(key)
             
             # Log the cleaned query
-            print(f"Cleaned SQL query: {sql_query}")
+            logger.debug("Cleaned SQL query: %s", sql_query)
             
             # Execute the query
-            results = self._execute_query(sql_query)
+            results, truncated = self._execute_query(sql_query)
+            
+            # Only SQL that ran is remembered, so asking again after an error gets a fresh query
+            if results is None:
+                results = []
+                self._forget_sql(key)
+            else:
+                self._remember_sql(key, sql_query)
             
-            # Log the results for debugging
-            print(f"Query results: {results}")
+            # Log the results for debugging; formatting up to MAX_RESULT_ROWS rows is costly
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Query results: %s", results)
             
             return {
                 "question": question,
                 "sql_query": sql_query,
-                "results": results
+                "results": results,
+                "truncated": truncated
             }
 
         except Exception as e:
@@ -125,26 +241,43 @@ Please provide ONLY the SQL query that answers this question. Do not include any
     def _check_database_status(self) -> Dict:
         """Check if the database has any data."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Check blocks table
-                cursor.execute("SELECT COUNT(*) FROM blocks")
-                block_count = cursor.fetchone()[0]
-                
-                # Check transactions table
-                cursor.execute("SELECT COUNT(*) FROM transactions")
-                tx_count = cursor.fetchone()[0]
-                
-                return {
-                    "has_data": block_count > 0 or tx_count > 0,
-                    "block_count": block_count,
-                    "transaction_count": tx_count
-                }
+            # MAX(rowid) reads one end of the rowid b-tree instead of scanning each table;
+            # rows are never deleted, so it tracks the row count
+            with self._lock:
+                cursor = self._conn.execute(
+                    "SELECT (SELECT MAX(rowid) FROM blocks), (SELECT MAX(rowid) FROM transactions)"
+                )
+                block_count, tx_count = cursor.fetchone()
+            
+            block_count = block_count or 0
+            tx_count = tx_count or 0
+            return {
+                "has_data": block_count > 0 or tx_count > 0,
+                "block_count": block_count,
+                "transaction_count": tx_count
+            }
         except sqlite3.Error as e:
             print(f"Error checking database status: {e}")
             return {"has_data": False, "error": str(e)}
 
+# Shared across chat sessions so the database connection outlives each session
+_qa: Optional[BitcoinQA] = None
+
+def _get_qa(db_path: str) -> BitcoinQA:
+    """Return the process-wide BitcoinQA instance, creating it on first use."""
+    global _qa
+    if _qa is None:
+        _qa = BitcoinQA(db_path)
+    return _qa
+
+def _csv_text(rows: List[List], headers: List[str]) -> str:
+    """Render rows as CSV text."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(headers)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
 @cl.on_chat_start
 async def start():
     # Initialize QA system
@@ -153,8 +286,8 @@ async def start():
         await cl.Message(content=f"Error: Database file not found at {db_path}").send()
         return
     
-    # Create QA instance
-    qa = BitcoinQA(db_path)
+    # Get the shared QA instance
+    qa = _get_qa(db_path)
     
     # Check database status
     db_status = qa._check_database_status()
@@ -194,10 +327,18 @@ async def main(message: cl.Message):
         # Format results as table
         if result['results']:
             try:
-                headers = result['results'][0].keys()
-                rows = [list(row.values()) for row in result['results']]
-                table = tabulate(rows, headers=headers, tablefmt="grid")
-                response += f"Results:\n```\n{table}\n```"
+                headers = list(result['results'][0].keys())
+                rows = [
+                    [_display_value(column, value) for column, value in row.items()]
+                    for row in result['results']
+                ]
+                if len(rows) > CSV_RESULT_THRESHOLD:
+                    response += f"Results:\n```csv\n{_csv_text(rows, headers)}```"
+                else:
+                    table = fast_grid(rows, headers)
+                    response += f"Results:\n```\n{table}\n```"
+                if result['truncated']:
+                    response += f"\n\nShowing the first {MAX_RESULT_ROWS} rows; the query returned more."
             except Exception as e:
                 response += f"Error formatting results: {str(e)}\n"
                 response += f"Raw results: {result['results']}"
@@ -1,45 +1,154 @@
-import json
+import msgspec
+import orjson
 import sqlite3
 import time
 import schedule
 import requests
-from typing import Dict, Any, List, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 import logging
+import logging.handlers
 from datetime import datetime
 import hashlib
 import os
+import re
 from dotenv import load_dotenv
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from create_schema import generate_bitcoin_schema
 
 # Load environment variables from config file
 load_dotenv('bitcoin_config.env')
 
 # Configure logging with more detailed format
+_log_file_handler = logging.FileHandler('blockchain_sync.log')
+_log_file_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
+))
+# Buffer records and write them in bulk; errors are flushed immediately and the
+# rest at the end of every sync run
+_log_buffer = logging.handlers.MemoryHandler(capacity=1000, target=_log_file_handler)
 logging.basicConfig(
     level=logging.DEBUG,  # Changed to DEBUG for more detailed logs
-    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
-    handlers=[
-        logging.FileHandler('blockchain_sync.log')
-    ]
+    handlers=[_log_buffer]
 )
 
+# Number of blocks written per database transaction during sync
+SYNC_BATCH_SIZE = 100
+
+# Number of full blocks requested per batched getblock RPC call
+BLOCK_FETCH_BATCH_SIZE = 10
+
+# Catch-up syncs longer than this drop the indexes below and rebuild them afterwards
+BULK_SYNC_THRESHOLD = 1000
+
+# Index definitions from the schema, used to restore any index missing from the database
+_SCHEMA_INDEX_SQL = [
+    sql.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1)
+    for sql in re.findall(r'^CREATE INDEX .*;$', generate_bitcoin_schema(), re.MULTILINE)
+]
+
+# Indexes used only by analytical queries; sync itself never reads them
+BULK_SYNC_DROPPED_INDEXES = (
+    'idx_blocks_height',
+    'idx_transactions_block_id',
+    'idx_transactions_fee',
+    'idx_inputs_txid',
+    'idx_outputs_txid',
+    'idx_outputs_address',
+    'idx_outputs_height',
+)
+
+# Statement text shared by every insert so sqlite3's statement cache is always hit
+_INSERT_BLOCK_SQL = """
+    INSERT INTO blocks (
+        hash, height, version, timestamp, size, weight,
+        merkle_root, nonce, bits, difficulty, previous_hash, next_hash
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Duplicate txids (the BIP30 coinbase transactions) are ignored rather than failing the block
+_INSERT_TX_SQL = """
+    INSERT OR IGNORE INTO transactions (
+        txid, block_id, version, size, weight, fee
+    ) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_INSERT_VIN_SQL = """
+    INSERT INTO inputs (
+        txid, previous_txid, previous_vout,
+        sequence, script_sig
+    ) VALUES (?, ?, ?, ?, ?)
+"""
+
+_INSERT_VOUT_SQL = """
+    INSERT INTO outputs (
+        txid, height, vout, value, script_pubkey, address
+    ) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# Encoder for the script_sig / script_pubkey BLOB columns
+_SCRIPT_ENCODER = msgspec.msgpack.Encoder()
+
+# Largest number of txids bound into one IN (...) lookup
+TXID_LOOKUP_BATCH_SIZE = 500
+
+# Size of the per-connection prepared statement cache
+STATEMENT_CACHE_SIZE = 128
+
+def _configure(conn: sqlite3.Connection) -> None:
+    """Apply write-friendly PRAGMAs to a new SQLite connection."""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-262144")  # 256 MB page cache
+    conn.execute("PRAGMA mmap_size=1073741824")  # 1 GB memory map
+
 class BlockchainSync:
     def __init__(self, rpc_url: str, rpc_user: str, rpc_password: str, db_path: str = 'bitcoin.db'):
         self.rpc_url = rpc_url
         self.rpc_auth = (rpc_user, rpc_password)
+        self.session = self._create_session()
         self.db_path = db_path
+        self.conn = sqlite3.connect(
+            self.db_path,
+            detect_types=0,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        _configure(self.conn)
+        # Restore indexes left dropped by an interrupted bulk sync
+        try:
+            self._ensure_indexes()
+        except sqlite3.Error as e:
+            logging.error(f"Database error restoring indexes: {e}")
         self.last_synced_height = self._get_last_synced_height()
         logging.info(f"Initialized BlockchainSync with URL: {rpc_url}")
         logging.debug(f"Using RPC credentials - User: {rpc_user}")
         
+    def _create_session(self) -> requests.Session:
+        """Create a keep-alive HTTP session for RPC calls to the Bitcoin node."""
+        session = requests.Session()
+        session.auth = self.rpc_auth
+        session.headers.update({'content-type': 'text/plain;'})
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=10,
+            max_retries=Retry(total=3, backoff_factor=0.2)
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
     def _get_last_synced_height(self) -> int:
         """Get the last synced block height from the database."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT MAX(height) FROM blocks")
-                result = cursor.fetchone()
-                return result[0] if result[0] is not None else 0
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT MAX(height) FROM blocks")
+            result = cursor.fetchone()
+            return result[0] if result[0] is not None else 0
         except sqlite3.Error as e:
             logging.error(f"Database error: {e}")
             return 0
@@ -57,7 +166,6 @@ class BlockchainSync:
 
     def _make_rpc_call(self, method: str, params: List = None) -> Dict:
         """Make an RPC call to the Bitcoin node."""
-        headers = {'content-type': 'text/plain;'}
         payload = {
             "jsonrpc": "1.0",
             "id": "curltest",
@@ -70,15 +178,13 @@ class BlockchainSync:
         logging.debug(f"Params: {params}")
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.rpc_url,
-                headers=headers,
-                data=json.dumps(payload),
-                auth=self.rpc_auth
+                data=orjson.dumps(payload)
             )
             
             response.raise_for_status()
-            result = response.json()
+            result = orjson.loads(response.content)
             
             if 'error' in result and result['error'] is not None:
                 error_msg = f"RPC error: {result['error']}"
@@ -92,7 +198,7 @@ class BlockchainSync:
             if hasattr(e.response, 'text'):
                 logging.error(f"Error response: {e.response.text}")
             raise
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logging.error(f"Failed to parse RPC response: {e}")
             logging.error(f"Raw response: {response.text if 'response' in locals() else 'No response'}")
             raise
@@ -100,100 +206,238 @@ class BlockchainSync:
             logging.error(f"Unexpected error in RPC call: {e}")
             raise
 
-    def _store_block(self, block_data: Dict) -> bool:
-        """Store block data in the database."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Insert block data
-                cursor.execute("""
-                    INSERT INTO blocks (
-                        hash, height, version, timestamp, size, weight,
-                        merkle_root, nonce, bits, difficulty, previous_hash, next_hash
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    block_data['hash'],
-                    block_data['height'],
-                    block_data['version'],
-                    block_data['time'],
-                    block_data['size'],
-                    block_data['weight'],
-                    block_data['merkleroot'],
-                    block_data['nonce'],
-                    block_data['bits'],
-                    block_data['difficulty'],
-                    block_data.get('previousblockhash'),
-                    block_data.get('nextblockhash')
-                ))
-                
-                block_id = cursor.lastrowid
-                
-                # Store transactions
-                for tx in block_data.get('tx', []):
-                    self._store_transaction(cursor, tx, block_id)
-                
-                conn.commit()
-                logging.info(f"Successfully stored block {block_data['hash']} at height {block_data['height']}")
-                return True
-                
-        except sqlite3.Error as e:
-            logging.error(f"Database error storing block: {e}")
-            return False
-
-    def _store_transaction(self, cursor: sqlite3.Cursor, tx_data: Dict, block_id: int) -> bool:
-        """Store transaction data in the database."""
-        try:
-            # Insert transaction
-            cursor.execute("""
-                INSERT INTO transactions (
-                    txid, block_id, version, size, weight, fee
-                ) VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                tx_data['txid'],
-                block_id,
-                tx_data['version'],
-                tx_data['size'],
-                tx_data['weight'],
-                tx_data.get('fee', 0)
-            ))
+    def _make_rpc_batch(self, calls: List[Tuple[str, List]]) -> List[Dict]:
+        """Make several RPC calls to the Bitcoin node in a single HTTP request.
+        
+        Returns the raw responses in call order; callers check each response's 'error' field.
+        """
+        if not calls:
+            return []
             
-            tx_id = cursor.lastrowid
+        payload = [
+            {
+                "jsonrpc": "1.0",
+                "id": i,
+                "method": method,
+                "params": params
+            }
+            for i, (method, params) in enumerate(calls)
+        ]
+        
+        logging.debug("Making batch RPC call to %s: %d x %s", self.rpc_url, len(calls), calls[0][0])
+        
+        try:
+            response = self.session.post(
+                self.rpc_url,
+                data=orjson.dumps(payload)
+            )
             
-            # Store inputs
-            for vin in tx_data.get('vin', []):
-                cursor.execute("""
-                    INSERT INTO inputs (
-                        transaction_id, previous_txid, previous_vout,
-                        sequence, script_sig
-                    ) VALUES (?, ?, ?, ?, ?)
-                """, (
-                    tx_id,
-                    vin.get('txid', ''),
-                    vin.get('vout', 0),
-                    vin.get('sequence', 0),
-                    json.dumps(vin.get('scriptSig', {}))
-                ))
+            response.raise_for_status()
+            results = orjson.loads(response.content)
             
-            # Store outputs
-            for vout in tx_data.get('vout', []):
-                cursor.execute("""
-                    INSERT INTO outputs (
-                        transaction_id, vout, value, script_pubkey, address
-                    ) VALUES (?, ?, ?, ?, ?)
-                """, (
-                    tx_id,
-                    vout['n'],
-                    vout['value'],
-                    json.dumps(vout['scriptPubKey']),
-                    vout['scriptPubKey'].get('addresses', [''])[0] if 'addresses' in vout['scriptPubKey'] else None
-                ))
+            return sorted(results, key=lambda result: result['id'])
             
-            return True
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Batch RPC call failed: {str(e)}")
+            if hasattr(e.response, 'text'):
+                logging.error(f"Error response: {e.response.text}")
+            raise
+        except orjson.JSONDecodeError as e:
+            logging.error(f"Failed to parse batch RPC response: {e}")
+            logging.error(f"Raw response: {response.text if 'response' in locals() else 'No response'}")
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error in batch RPC call: {e}")
+            raise
+
+    def _fetch_block_batch(self, batch: List[Tuple[int, Dict]]) -> List[Dict]:
+        """Fetch the full blocks for a batch of (height, getblockhash response) pairs."""
+        return self._make_rpc_batch([
+            ('getblock', [hash_response['result'], 2])
+            for _, hash_response in batch
+            if hash_response.get('error') is None
+        ])
+
+    def _iter_block_responses(self, heights: List[int]) -> Iterator[Tuple[int, Dict]]:
+        """Yield (height, getblock response) pairs, fetching blocks with batched RPC calls.
+        
+        The next batch is fetched and parsed in a worker thread while the caller
+        stores the current one.
+        """
+        hash_responses = self._make_rpc_batch([('getblockhash', [height]) for height in heights])
+        batches = [
+            list(zip(
+                heights[offset:offset + BLOCK_FETCH_BATCH_SIZE],
+                hash_responses[offset:offset + BLOCK_FETCH_BATCH_SIZE]
+            ))
+            for offset in range(0, len(heights), BLOCK_FETCH_BATCH_SIZE)
+        ]
+        if not batches:
+            return
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(self._fetch_block_batch, batches[0])
+            for i, batch in enumerate(batches):
+                block_responses = iter(pending.result())
+                if i + 1 < len(batches):
+                    pending = executor.submit(self._fetch_block_batch, batches[i + 1])
+                
+                for height, hash_response in batch:
+                    # A failed getblockhash has no matching getblock call
+                    if hash_response.get('error') is not None:
+                        yield height, hash_response
+                    else:
+                        yield height, next(block_responses)
+
+    def _store_block(self, cursor: sqlite3.Cursor, block_data: Dict) -> None:
+        """Store block data in the database using the caller's open transaction."""
+        # Insert block data
+        cursor.execute(_INSERT_BLOCK_SQL, (
+            block_data['hash'],
+            block_data['height'],
+            block_data['version'],
+            block_data['time'],
+            block_data['size'],
+            block_data['weight'],
+            block_data['merkleroot'],
+            block_data['nonce'],
+            block_data['bits'],
+            block_data['difficulty'],
+            block_data.get('previousblockhash'),
+            block_data.get('nextblockhash')
+        ))
+        
+        block_id = cursor.lastrowid
+        
+        # Store transactions
+        self._store_transactions(cursor, block_data.get('tx', []), block_id, block_data['height'])
+
+    def _store_transactions(
+        self, cursor: sqlite3.Cursor, transactions: List[Dict], block_id: int, height: int
+    ) -> None:
+        """Store a block's transactions and their inputs/outputs with one executemany per table."""
+        # Insert transactions
+        cursor.executemany(_INSERT_TX_SQL, [
+            (
+                tx['txid'],
+                block_id,
+                tx['version'],
+                tx['size'],
+                tx['weight'],
+                tx.get('fee', 0)
+            )
+            for tx in transactions
+        ])
+        
+        # Skip the inputs/outputs of transactions whose txid was already stored
+        if cursor.rowcount != len(transactions):
+            stored_txids = self._txids_in_block(cursor, [tx['txid'] for tx in transactions], block_id)
+            for tx in transactions:
+                if tx['txid'] not in stored_txids:
+                    logging.warning("Skipping duplicate transaction %s at height %d", tx['txid'], height)
+            transactions = [tx for tx in transactions if tx['txid'] in stored_txids]
+        
+        # Store inputs
+        cursor.executemany(_INSERT_VIN_SQL, [
+            (
+                tx['txid'],
+                vin.get('txid', ''),
+                vin.get('vout', 0),
+                vin.get('sequence', 0),
+                _SCRIPT_ENCODER.encode(vin.get('scriptSig', {}))
+            )
+            for tx in transactions
+            for vin in tx.get('vin', [])
+        ])
+        
+        # Store outputs
+        cursor.executemany(_INSERT_VOUT_SQL, [
+            (
+                tx['txid'],
+                height,
+                vout['n'],
+                vout['value'],
+                _SCRIPT_ENCODER.encode(vout['scriptPubKey']),
+                vout['scriptPubKey'].get('addresses', [''])[0] if 'addresses' in vout['scriptPubKey'] else None
+            )
+            for tx in transactions
+            for vout in tx.get('vout', [])
+        ])
+
+    def _txids_in_block(self, cursor: sqlite3.Cursor, txids: List[str], block_id: int) -> set:
+        """Return the txids from txids that are stored under block_id."""
+        stored = set()
+        for offset in range(0, len(txids), TXID_LOOKUP_BATCH_SIZE):
+            batch = txids[offset:offset + TXID_LOOKUP_BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(
+                f"SELECT txid FROM transactions WHERE block_id = ? AND txid IN ({placeholders})",
+                [block_id, *batch]
+            )
+            stored.update(txid for txid, in cursor.fetchall())
+        return stored
+
+    def _drop_indexes(self) -> None:
+        """Drop the analytical indexes before a bulk sync."""
+        for name in BULK_SYNC_DROPPED_INDEXES:
+            self.conn.execute(f"DROP INDEX IF EXISTS {name}")
+        logging.info(f"Dropped {len(BULK_SYNC_DROPPED_INDEXES)} indexes for bulk sync")
+
+    def _index_names(self) -> set:
+        cursor = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        return {name for name, in cursor.fetchall()}
+
+    def _ensure_indexes(self) -> None:
+        """Create any schema index missing from the database and refresh planner statistics."""
+        existing = self._index_names()
+        for sql in _SCHEMA_INDEX_SQL:
+            self.conn.execute(sql)
+        created = self._index_names() - existing
+        if created:
+            self.conn.execute("ANALYZE")
+            logging.info(f"Rebuilt {len(created)} indexes: {', '.join(sorted(created))}")
+
+    def _sync_block_range(self, start_height: int, end_height: int) -> bool:
+        """Sync blocks in [start_height, end_height) inside a single database transaction.
+        
+        Returns False if syncing should stop after this range.
+        """
+        cursor = self.conn.cursor()
+        synced_height = self.last_synced_height
+        completed = True
+        
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for height, response in self._iter_block_responses(list(range(start_height, end_height))):
+                error = response.get('error')
+                if error is not None:
+                    if "Block not available (pruned data)" in str(error):
+                        logging.warning("Block at height %d is pruned, skipping", height)
+                        synced_height = height
+                        continue
+                    logging.error("Error processing block at height %d: %s", height, error)
+                    completed = False
+                    break
+                
+                block_data = response['result']
+                logging.debug("Got block data for height %d", height)
+                
+                self._store_block(cursor, block_data)
+                synced_height = height
             
-        except sqlite3.Error as e:
-            logging.error(f"Database error storing transaction: {e}")
+            self.conn.execute("COMMIT")
+        except Exception as e:
+            self.conn.execute("ROLLBACK")
+            logging.error("Error syncing blocks %d-%d, rolled back: %s", start_height, end_height - 1, e)
             return False
+        except BaseException:
+            # KeyboardInterrupt / SystemExit: close the transaction before unwinding
+            self.conn.execute("ROLLBACK")
+            raise
+        
+        self.last_synced_height = synced_height
+        logging.info("Synced blocks %d-%d", start_height, synced_height)
+        return completed
 
     def sync_latest_blocks(self):
         """Sync the latest blocks from the blockchain."""
@@ -215,33 +459,26 @@ class BlockchainSync:
                 logging.info("Database is up to date")
                 return
                 
-            # Sync missing blocks
-            for height in range(start_height, current_height + 1):
-                logging.info(f"Processing block at height {height}")
-                try:
-                    block_hash = self._make_rpc_call('getblockhash', [height])
-                    logging.debug(f"Got block hash: {block_hash}")
-                    
-                    block_data = self._make_rpc_call('getblock', [block_hash, 2])
-                    logging.debug(f"Got block data for height {height}")
-                    
-                    if self._store_block(block_data):
-                        self.last_synced_height = height
-                        logging.info(f"Successfully synced block at height {height}")
-                    else:
-                        logging.error(f"Failed to sync block at height {height}")
-                        break
-                except Exception as e:
-                    if "Block not available (pruned data)" in str(e):
-                        logging.warning(f"Block at height {height} is pruned, skipping")
-                        self.last_synced_height = height
-                        continue
-                    else:
-                        logging.error(f"Error processing block at height {height}: {e}")
+            # Skip per-insert index maintenance when catching up on many blocks
+            bulk_sync = current_height - start_height > BULK_SYNC_THRESHOLD
+            if bulk_sync:
+                self._drop_indexes()
+                
+            # Sync missing blocks, committing once per batch
+            try:
+                for batch_start in range(start_height, current_height + 1, SYNC_BATCH_SIZE):
+                    batch_end = min(batch_start + SYNC_BATCH_SIZE, current_height + 1)
+                    if not self._sync_block_range(batch_start, batch_end):
                         break
+            finally:
+                if bulk_sync:
+                    self._ensure_indexes()
                     
         except Exception as e:
             logging.error(f"Sync failed: {str(e)}", exc_info=True)
+        finally:
+            # Don't leave a quiet run's records sitting in memory until the next one
+            _log_buffer.flush()
 
 def main():
     # Configuration from environment variables
@@ -1,6 +1,14 @@
 import sqlite3
 import os
 
+def _configure(conn: sqlite3.Connection) -> None:
+    """Switch the new database to WAL and apply the shared connection PRAGMAs."""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-262144")  # 256 MB page cache
+    conn.execute("PRAGMA mmap_size=1073741824")  # 1 GB memory map
+
 def create_database(schema_file: str, db_name: str = None) -> None:
     """
     Create a SQLite database using the provided schema file.
@@ -24,11 +32,15 @@ def create_database(schema_file: str, db_name: str = None) -> None:
         
         # Create and connect to the database
         conn = sqlite3.connect(db_name)
+        _configure(conn)
         cursor = conn.cursor()
         
         # Execute the schema
         cursor.executescript(schema)
         
+        # Collect statistics so the query planner picks up the indexes
+        cursor.execute("ANALYZE")
+        
         # Commit the changes and close the connection
         conn.commit()
         conn.close()
@@ -41,6 +53,7 @@ def create_database(schema_file: str, db_name: str = None) -> None:
             
             # Connect to verify tables were created
             conn = sqlite3.connect(db_name)
+            _configure(conn)
             cursor = conn.cursor()
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
             tables = cursor.fetchall()
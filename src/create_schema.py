@@ -26,8 +26,7 @@ CREATE TABLE blocks (
 
 -- Transactions table
 CREATE TABLE transactions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    txid TEXT NOT NULL UNIQUE,
+    txid TEXT NOT NULL PRIMARY KEY,
     block_id INTEGER NOT NULL,
     version INTEGER NOT NULL,
     size INTEGER NOT NULL,
@@ -40,34 +39,37 @@ CREATE TABLE transactions (
 -- Inputs table
 CREATE TABLE inputs (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    transaction_id INTEGER NOT NULL,
+    txid TEXT NOT NULL,
     previous_txid TEXT NOT NULL,
     previous_vout INTEGER NOT NULL,
     sequence INTEGER NOT NULL,
-    script_sig TEXT NOT NULL,
+    script_sig BLOB NOT NULL,  -- msgpack-encoded; decode to JSON with msgpack_text(script_sig)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (transaction_id) REFERENCES transactions(id)
+    FOREIGN KEY (txid) REFERENCES transactions(txid)
 );
 
 -- Outputs table
 CREATE TABLE outputs (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    transaction_id INTEGER NOT NULL,
+    txid TEXT NOT NULL,
+    height INTEGER NOT NULL,  -- height of the containing block; outputs are stored in height order
     vout INTEGER NOT NULL,
     value INTEGER NOT NULL,
-    script_pubkey TEXT NOT NULL,
+    script_pubkey BLOB NOT NULL,  -- msgpack-encoded; decode to JSON with msgpack_text(script_pubkey)
     address TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (transaction_id) REFERENCES transactions(id)
+    FOREIGN KEY (txid) REFERENCES transactions(txid)
 );
 
 -- Indexes
 CREATE INDEX idx_blocks_hash ON blocks(hash);
-CREATE INDEX idx_blocks_height ON blocks(height);
-CREATE INDEX idx_transactions_txid ON transactions(txid);
+CREATE INDEX idx_blocks_height ON blocks(height, timestamp, id);
 CREATE INDEX idx_transactions_block_id ON transactions(block_id);
-CREATE INDEX idx_inputs_transaction_id ON inputs(transaction_id);
-CREATE INDEX idx_outputs_transaction_id ON outputs(transaction_id);
+CREATE INDEX idx_transactions_fee ON transactions(fee);
+CREATE INDEX idx_inputs_txid ON inputs(txid);
+CREATE INDEX idx_outputs_txid ON outputs(txid, address, value);
+CREATE INDEX idx_outputs_address ON outputs(address);
+CREATE INDEX idx_outputs_height ON outputs(height, address, value);
 """
     return schema
 
@@ -0,0 +1,14 @@
+from typing import List
+
+def fast_grid(rows: List[List], headers: List[str]) -> str:
+    """Render rows as a grid table, a lightweight stand-in for tabulate(tablefmt="grid")."""
+    cells = [["" if value is None else str(value) for value in row] for row in rows]
+    headers = [str(header) for header in headers]
+    widths = [max(map(len, column)) for column in zip(headers, *cells)]
+    border = "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+    lines = [
+        "| " + " | ".join(f"{value:<{width}}" for value, width in zip(row, widths)) + " |"
+        for row in cells
+    ]
+    header = "| " + " | ".join(f"{value:<{width}}" for value, width in zip(headers, widths)) + " |"
+    return "\n".join([border, header, border.replace("-", "=")] + lines + [border])
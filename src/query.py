@@ -1,10 +1,38 @@
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 from tabulate import tabulate
 import time
 
+from db_utils import FETCH_SIZE, prewarm
+from formatting import fast_grid
+
+def _configure(conn, read_only=False):
+    """Apply read-friendly PRAGMAs to a new SQLite connection."""
+    # Switching journal mode needs write access; WAL persists in the file once set
+    if not read_only:
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-262144")  # 256 MB page cache
+    conn.execute("PRAGMA mmap_size=4294967296")  # 4 GB memory map
+
+def _fetch_rows(cursor):
+    """Fetch all remaining rows from a cursor in FETCH_SIZE chunks."""
+    cursor.arraysize = FETCH_SIZE
+    rows = []
+    while True:
+        chunk = cursor.fetchmany()
+        if not chunk:
+            break
+        rows.extend(chunk)
+    return rows
+
 def print_table_schema(db_path):
     try:
         with sqlite3.connect(db_path) as conn:
+            _configure(conn)
             cursor = conn.cursor()
             
             # Get all tables
@@ -48,6 +76,7 @@ def print_table_schema(db_path):
 
 def get_table_contents(db_path, table_name):
     with sqlite3.connect(db_path) as conn:
+        _configure(conn)
         cursor = conn.cursor()
 
         # First get the column names
@@ -56,164 +85,238 @@ def get_table_contents(db_path, table_name):
         headers = [col[1] for col in columns]  # Get column names
 
         cursor.execute(f"SELECT * FROM {table_name};")
-        row_count = cursor.fetchone()[0]
+        rows = _fetch_rows(cursor)
         
-        if row_count == 0:
+        if not rows:
             print(f"\nTable '{table_name}' is empty (0 rows)")
             return
 
-        cursor.execute(f"SELECT * FROM {table_name};")
-        rows = cursor.fetchall()
-
         print(f"\nContents of table: {table_name}")
         print("-" * 80)
-        print(tabulate(rows, headers=headers, tablefmt="grid"))
+        print(fast_grid(rows, headers))
         print()
 
         return
 
-def get_row_by_query(db_path, query):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        return rows
+# Connections kept open across calls so sqlite3's statement cache keeps the
+# analytical queries compiled; thresholds are bound as parameters so the SQL
+# text, and with it the cached statement, is the same for every call. Each
+# thread gets its own connections, keyed by database path, so queries can run
+# concurrently as separate WAL readers.
+_local = threading.local()
 
-def get_complex_query_1(db_path):
-    """Find blocks with high transaction fees and volume."""
-    query = """
-    WITH block_stats AS (
-        SELECT 
-            b.height,
-            b.timestamp,
-            COUNT(t.txid) as tx_count,
-            AVG(t.fee) as avg_fee
-        FROM blocks b
-        JOIN transactions t ON b.id = t.block_id
-        GROUP BY b.height, b.timestamp
-        HAVING COUNT(t.txid) > 1000
-    ),
-    overall_avg AS (
-        SELECT AVG(t.fee) as global_avg_fee
-        FROM transactions t
-    )
+def _get_connection(db_path):
+    """Return this thread's read-only connection for db_path, opening it on first use."""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        # Read-only path: no declared-type conversion and no implicit transactions
+        uri = Path(db_path).absolute().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, detect_types=0, isolation_level=None)
+        _configure(conn, read_only=True)
+        connections[db_path] = conn
+    return conn
+
+def get_row_by_query(db_path, query, params=()):
+    cursor = _get_connection(db_path).cursor()
+    cursor.execute(query, params)
+    rows = _fetch_rows(cursor)
+    return rows
+
+_Q1_SQL = """
+WITH block_stats AS (
     SELECT 
-        bs.height,
-        datetime(bs.timestamp, 'unixepoch') as block_time,
-        bs.tx_count,
-        ROUND(bs.avg_fee, 8) as avg_fee_per_block
-    FROM block_stats bs
-    CROSS JOIN overall_avg oa
-    WHERE bs.avg_fee > oa.global_avg_fee
-    ORDER BY bs.height DESC
-    LIMIT 3;
-    """
-    return get_row_by_query(db_path, query)
+        b.height,
+        b.timestamp,
+        COUNT(t.txid) as tx_count,
+        AVG(t.fee) as avg_fee
+    FROM blocks b
+    JOIN transactions t ON b.id = t.block_id
+    GROUP BY b.height, b.timestamp
+    HAVING COUNT(t.txid) > :min_tx_count
+),
+overall_avg AS (
+    SELECT AVG(t.fee) as global_avg_fee
+    FROM transactions t
+)
+SELECT 
+    bs.height,
+    datetime(bs.timestamp, 'unixepoch') as block_time,
+    bs.tx_count,
+    ROUND(bs.avg_fee, 8) as avg_fee_per_block
+FROM block_stats bs
+CROSS JOIN overall_avg oa
+WHERE bs.avg_fee > oa.global_avg_fee
+ORDER BY bs.height DESC
+LIMIT 3;
+"""
 
-def get_complex_query_2(db_path):
-    """Find high-value transactions with multiple inputs and outputs."""
-    query = """
-    WITH tx_io_counts AS (
-        SELECT 
-            t.txid,
-            COUNT(DISTINCT i.id) as input_count,
-            COUNT(DISTINCT o.id) as output_count,
-            SUM(o.value) as total_output,
-            b.height,
-            b.timestamp
-        FROM transactions t
-        JOIN inputs i ON t.id = i.transaction_id
-        JOIN outputs o ON t.id = o.transaction_id
-        JOIN blocks b ON t.block_id = b.id
-        GROUP BY t.txid, b.height, b.timestamp
-        HAVING input_count >= 3 AND output_count >= 3
-    ),
-    fee_percentiles AS (
-        SELECT 
-            txid,
-            total_output,
-            height,
-            timestamp,
-            PERCENT_RANK() OVER (ORDER BY total_output) as value_percentile
-        FROM tx_io_counts
-        WHERE total_output > 10000000000  -- 100 BTC in satoshis
-    )
+def get_complex_query_1(db_path, min_tx_count=1000):
+    """Find blocks with high transaction fees and volume."""
+    return get_row_by_query(db_path, _Q1_SQL, {"min_tx_count": min_tx_count})
+
+_Q2_SQL = """
+WITH tx_io_counts AS (
+    SELECT 
+        t.txid,
+        COUNT(DISTINCT i.id) as input_count,
+        COUNT(DISTINCT o.id) as output_count,
+        SUM(o.value) as total_output,
+        b.height,
+        b.timestamp
+    FROM transactions t
+    JOIN inputs i ON t.txid = i.txid
+    JOIN outputs o ON t.txid = o.txid
+    JOIN blocks b ON t.block_id = b.id
+    GROUP BY t.txid, b.height, b.timestamp
+    HAVING input_count >= 3 AND output_count >= 3
+),
+high_value_txs AS (
     SELECT 
         txid,
-        ROUND(total_output / 100000000.0, 8) as total_output_btc,
+        total_output,
         height,
-        datetime(timestamp, 'unixepoch') as block_time
-    FROM fee_percentiles
-    WHERE value_percentile >= 0.9
+        timestamp
+    FROM tx_io_counts
+    WHERE total_output > :min_total_output
+),
+top_candidates AS (
+    -- ORDER BY + LIMIT runs as a bounded top-N sort instead of ranking every row
+    SELECT *
+    FROM high_value_txs
     ORDER BY total_output DESC
-    LIMIT 3;
-    """
-    return get_row_by_query(db_path, query)
+    LIMIT 3
+)
+SELECT 
+    c.txid,
+    ROUND(c.total_output / 100000000.0, 8) as total_output_btc,
+    c.height,
+    datetime(c.timestamp, 'unixepoch') as block_time
+FROM top_candidates c
+-- PERCENT_RANK() >= 0.9, computed for the candidates only; division by zero
+-- yields NULL for a single row, matching PERCENT_RANK() = 0
+WHERE CAST((SELECT COUNT(*) FROM high_value_txs h WHERE h.total_output < c.total_output) AS REAL)
+      / ((SELECT COUNT(*) FROM high_value_txs) - 1) >= 0.9
+ORDER BY c.total_output DESC;
+"""
 
-def get_complex_query_3(db_path):
-    """Find blocks with high transaction volume and address statistics."""
-    query = """
-    WITH block_volumes AS (
-        SELECT 
-            b.height,
-            b.timestamp,
-            SUM(o.value) as total_volume
-        FROM blocks b
-        JOIN transactions t ON b.id = t.block_id
-        JOIN outputs o ON t.id = o.transaction_id
-        GROUP BY b.height, b.timestamp
-        HAVING SUM(o.value) > 100000000000  -- 1000 BTC in satoshis
-    ),
-    address_stats AS (
-        SELECT 
-            b.height,
-            COUNT(DISTINCT o.address) as unique_addresses,
-            AVG(o.value) as avg_output_per_address,
-            COUNT(CASE WHEN address_count > 1 THEN 1 END) * 100.0 / COUNT(*) as percent_repeated_addresses
-        FROM blocks b
-        JOIN transactions t ON b.id = t.block_id
-        JOIN outputs o ON t.id = o.transaction_id
-        JOIN (
-            SELECT height, address, COUNT(*) as address_count
-            FROM blocks b2
-            JOIN transactions t2 ON b2.id = t2.block_id
-            JOIN outputs o2 ON t2.id = o2.transaction_id
-            GROUP BY height, address
-        ) addr_counts ON b.height = addr_counts.height AND o.address = addr_counts.address
-        WHERE b.height IN (SELECT height FROM block_volumes)
-        GROUP BY b.height
-    )
+def get_complex_query_2(db_path, min_total_output=10000000000):  # 100 BTC in satoshis
+    """Find high-value transactions with multiple inputs and outputs."""
+    return get_row_by_query(db_path, _Q2_SQL, {"min_total_output": min_total_output})
+
+_Q3_SQL = """
+WITH block_volumes AS (
+    -- Aggregate outputs by their own height column, in idx_outputs_height order
+    SELECT 
+        b.height,
+        b.timestamp,
+        v.total_volume
+    FROM (
+        SELECT o.height, SUM(o.value) as total_volume
+        FROM outputs o
+        GROUP BY o.height
+        HAVING SUM(o.value) > :min_volume
+    ) v
+    JOIN blocks b ON b.height = v.height
+),
+address_outputs AS (
+    -- Single pass over the outputs of high-volume blocks, counting address reuse per block;
+    -- the height filter seeks straight to those blocks' outputs
+    SELECT 
+        o.height,
+        o.address,
+        o.value,
+        COUNT(*) OVER (PARTITION BY o.height, o.address) as address_count
+    FROM outputs o
+    WHERE o.height IN (SELECT height FROM block_volumes)
+      AND o.address IS NOT NULL
+),
+address_stats AS (
     SELECT 
-        bv.height,
-        datetime(bv.timestamp, 'unixepoch') as block_time,
-        ROUND(bv.total_volume / 100000000.0, 8) as total_volume_btc,
-        addr_stats.unique_addresses,
-        ROUND(addr_stats.avg_output_per_address / 100000000.0, 8) as avg_output_per_address_btc,
-        ROUND(addr_stats.percent_repeated_addresses, 2) as percent_repeated_addresses
-    FROM block_volumes bv
-    JOIN address_stats addr_stats ON bv.height = addr_stats.height
-    ORDER BY bv.height DESC
-    LIMIT 3;
+        height,
+        COUNT(DISTINCT address) as unique_addresses,
+        AVG(value) as avg_output_per_address,
+        COUNT(CASE WHEN address_count > 1 THEN 1 END) * 100.0 / COUNT(*) as percent_repeated_addresses
+    FROM address_outputs
+    GROUP BY height
+)
+SELECT 
+    bv.height,
+    datetime(bv.timestamp, 'unixepoch') as block_time,
+    ROUND(bv.total_volume / 100000000.0, 8) as total_volume_btc,
+    addr_stats.unique_addresses,
+    ROUND(addr_stats.avg_output_per_address / 100000000.0, 8) as avg_output_per_address_btc,
+    ROUND(addr_stats.percent_repeated_addresses, 2) as percent_repeated_addresses
+FROM block_volumes bv
+JOIN address_stats addr_stats ON bv.height = addr_stats.height
+ORDER BY bv.height DESC
+LIMIT 3;
+"""
+
+def get_complex_query_3(db_path, min_volume=100000000000):  # 1000 BTC in satoshis
+    """Find blocks with high transaction volume and address statistics."""
+    return get_row_by_query(db_path, _Q3_SQL, {"min_volume": min_volume})
+
+_COMPLEX_QUERIES = {1: get_complex_query_1, 2: get_complex_query_2, 3: get_complex_query_3}
+
+# Shared by every run_complex_queries() call so the worker threads, and the
+# per-thread connections and statement caches they hold, are reused
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    """Return the module's query thread pool, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=len(_COMPLEX_QUERIES), thread_name_prefix="query")
+        return _executor
+
+def run_complex_queries(db_path):
+    """Run the three analytical queries concurrently, one read connection per worker.
+    
+    Yields (query_number, future) pairs as each query finishes.
     """
-    return get_row_by_query(db_path, query)
+    executor = _get_executor()
+    futures = {executor.submit(query, db_path): number for number, query in _COMPLEX_QUERIES.items()}
+    for future in as_completed(futures):
+        yield futures[future], future
 
 if __name__ == "__main__":
     db_path = "bitcoin.db"
     
+    titles = {
+        1: "Blocks with high transaction fees and volume",
+        2: "High-value transactions with multiple inputs and outputs",
+        3: "Blocks with high transaction volume and address statistics",
+    }
+    headers = {
+        1: ["Height", "Block Time", "Transactions", "Avg Fee"],
+        2: ["TXID", "Total Output (BTC)", "Height", "Block Time"],
+        3: ["Height", "Block Time", "Volume (BTC)", "Unique Addresses", "Avg Output/Address (BTC)", "% Repeated Addresses"],
+    }
+    
     print("Starting script...")
+    try:
+        prewarm(db_path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error pre-warming database: {e}")
     start_time = time.time()
     
-    print("\nExecuting Query 3: Blocks with high transaction volume and address statistics")
-    print("-" * 80)
-    try:
-        results3 = get_complex_query_3(db_path)
-        print(f"Query 3 returned {len(results3)} results")
-        if results3:
-            print(tabulate(results3, headers=["Height", "Block Time", "Volume (BTC)", "Unique Addresses", "Avg Output/Address (BTC)", "% Repeated Addresses"], tablefmt="grid"))
-        else:
-            print("No results found for Query 3")
-    except Exception as e:
-        print(f"Error in Query 3: {str(e)}")
+    for number, future in run_complex_queries(db_path):
+        print(f"\nQuery {number}: {titles[number]}")
+        print("-" * 80)
+        try:
+            results = future.result()
+            print(f"Query {number} returned {len(results)} results")
+            if results:
+                print(tabulate(results, headers=headers[number], tablefmt="grid"))
+            else:
+                print(f"No results found for Query {number}")
+        except Exception as e:
+            print(f"Error in Query {number}: {str(e)}")
     
     end_time = time.time()
     print(f"\nQuery execution time: {end_time - start_time:.2f} seconds")
\ No newline at end of file